@@ -3,18 +3,40 @@
 from __future__ import annotations
 
 import argparse
+from functools import partial
+import os
 import pprint
 import selectors
 import sys
+import threading
 import time
 import typing
 
 import v4l2
 from v4l2.videodev import VideoCaptureStreamer
 
-from cam_helpers import read_config, save_fb_to_file, disable_all_links, configure_subdevs, setup_links
+from cam_helpers import read_config, save_fb_to_file, configure_subdevs, setup_links
+from cam_helpers import FrameSaver, unmap_buffers
 from cam_types import Stream, Context, Subcontext
 
+# How often, in frames, to check if it's time to print the fps
+FPS_SAMPLE_INTERVAL = 8
+
+# Max number of frames waiting to be written to files
+SAVE_MAX_PENDING = 4
+
+def parse_cpu_list(s: str) -> set[int]:
+    try:
+        cpus = {int(c) for c in s.split(',')}
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'bad CPU list: {s}') from None
+
+    bad = cpus - os.sched_getaffinity(0)
+    if bad:
+        raise argparse.ArgumentTypeError(f'CPUs not available: {sorted(bad)}')
+
+    return cpus
+
 def parse_args(ctx: Context):
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config-only', action='store_true', default=False, help='configure only')
@@ -30,6 +52,8 @@ def parse_args(ctx: Context):
     parser.add_argument('-H', '--host', default='192.168.88.20', type=str)
     parser.add_argument('-P', '--port', default=43242, type=int)
     parser.add_argument('-n', '--numframes', default=0, type=int, help='Number of frames to capture')
+    parser.add_argument('--cpus', type=parse_cpu_list,
+                        help='Run the capture loop on these CPUs, and the other threads on the rest (e.g. 2,3)')
     parser.add_argument('config_names', nargs='*', help='<config name>[:<stream name>[,<stream name>...]]')
     args = parser.parse_args()
 
@@ -39,6 +63,7 @@ def parse_args(ctx: Context):
     ctx.delay = args.delay
     ctx.save = args.save
     ctx.exit_num_frames = args.numframes
+    ctx.cpus = args.cpus
 
     ctx.use_ipython = args.ipython
 
@@ -99,8 +124,6 @@ def init_links(ctx: Context):
         if not sctx.md:
             continue
 
-        disable_all_links(sctx.md)
-
         setup_links(sctx, sctx.config)
 
 
@@ -237,6 +260,8 @@ def setup_sctx(sctx: Subcontext):
         else:
             cap.reserve_buffers(stream.num_bufs)
 
+        stream.buf_maps = [None] * stream.num_bufs
+
         skip_first = False
         if ctx.consumer:
             skip_first = ctx.consumer.setup_stream(ctx, stream)
@@ -268,11 +293,6 @@ def setup_sctx(sctx: Subcontext):
         ctx.updater = None
 
 
-def queue_buf(stream: Stream, vbuf: v4l2.VideoBuffer):
-    cap = stream.cap
-    cap.queue(vbuf)
-
-
 def readvid(sctx: Subcontext, stream: Stream):
     ctx = sctx.ctx
 
@@ -282,19 +302,22 @@ def readvid(sctx: Subcontext, stream: Stream):
     if ctx.updater:
         ctx.updater.update()
 
-    stream.total_num_frames += 1
+    total_num_frames = stream.total_num_frames + 1
+    stream.total_num_frames = total_num_frames
 
-    if stream.total_num_frames == ctx.exit_num_frames:
+    if total_num_frames == ctx.exit_num_frames:
         ctx.exit = True
 
-    # With IPython we have separate fps tracking
-    if not ctx.use_ipython:
+    # With IPython we have separate fps tracking. The fps is printed only
+    # about once per second, so there's no need to read the time on every frame.
+    if not ctx.use_ipython and (total_num_frames == 1 or
+                                total_num_frames % FPS_SAMPLE_INTERVAL == 0):
         ts = time.perf_counter()
 
         diff = ts - stream.last_timestamp
-        num_frames = stream.total_num_frames - stream.last_framenum
+        num_frames = total_num_frames - stream.last_framenum
 
-        if stream.total_num_frames == 1:
+        if total_num_frames == 1:
             print('{}: first frame in {:.2f} s'
                   .format(stream.dev_path, diff))
 
@@ -303,24 +326,21 @@ def readvid(sctx: Subcontext, stream: Stream):
                   .format(stream.dev_path, num_frames, diff, num_frames / diff))
 
             stream.last_timestamp = ts
-            stream.last_framenum = stream.total_num_frames
+            stream.last_framenum = total_num_frames
 
     cap = stream.cap
     vbuf = cap.dequeue()
 
-    fb = None
-
-    if ctx.buf_type == 'drm':
-        fb = next((fb for fb in stream.fbs if fb.fd(0) == vbuf.fd), None)
-        assert fb is not None
-
     if ctx.save:
-        save_fb_to_file(stream, ctx.buf_type == 'drm', fb if ctx.buf_type == 'drm' else vbuf)
+        assert ctx.saver
+        save_fb_to_file(ctx.saver, stream, ctx.buf_type == 'drm', vbuf)
 
-    if ctx.consumer:
-        ctx.consumer.handle_frame(ctx, stream, vbuf)
+    consumer = ctx.consumer
+
+    if consumer:
+        consumer.handle_frame(ctx, stream, vbuf)
     else:
-        queue_buf(stream, vbuf)
+        cap.queue(vbuf)
 
 
 def readkey(ctx: Context):
@@ -336,14 +356,31 @@ def readkey(ctx: Context):
     ctx.exit = True
 
 
+def set_cpu_affinity(cpus: set[int]):
+    # Move the already started threads (net sender, file writer) to the
+    # remaining CPUs, if there are any, and pin this thread to 'cpus'
+    others = os.sched_getaffinity(0) - cpus
+
+    if others:
+        current = threading.current_thread()
+        for t in threading.enumerate():
+            if t is not current and t.native_id:
+                os.sched_setaffinity(t.native_id, others)
+
+    os.sched_setaffinity(0, cpus)
+
+
 def run(ctx: Context):
     ctx.exit = False
 
+    if ctx.cpus:
+        set_cpu_affinity(ctx.cpus)
+
     sel = selectors.DefaultSelector()
 
     # Register stdin only it's a tty and we are not in IPython mode
     if sys.stdin.isatty() and not ctx.use_ipython:
-        sel.register(sys.stdin, selectors.EVENT_READ, lambda: readkey(ctx))
+        sel.register(sys.stdin, selectors.EVENT_READ, partial(readkey, ctx))
 
     if ctx.consumer:
         ctx.consumer.register_selector(sel)
@@ -351,19 +388,21 @@ def run(ctx: Context):
     for sctx in ctx.subcontexts:
         for stream in sctx.streams:
             sel.register(stream.cap.fd,
-                        selectors.EVENT_READ | selectors.EVENT_WRITE,
-                        lambda data=stream: readvid(sctx, data))
+                         selectors.EVENT_READ | selectors.EVENT_WRITE,
+                         partial(readvid, sctx, stream))
 
     if not ctx.use_ipython:
+        select = sel.select
+        consumer = ctx.consumer
+
         while not ctx.exit:
-            events = sel.select()
+            events = select()
 
-            if ctx.consumer:
-                ctx.consumer.handle_tick(ctx)
+            if consumer:
+                consumer.handle_tick(ctx)
 
             for key, _ in events:
-                callback = key.data
-                callback()
+                key.data()
     else:
         ctx.run_ipython(ctx, sel)
 
@@ -397,12 +436,23 @@ def main():
     if ctx.config_only:
         sys.exit(0)
 
-    setup(ctx)
+    ctx.saver = FrameSaver(SAVE_MAX_PENDING) if ctx.save else None
 
-    run(ctx)
+    try:
+        setup(ctx)
 
-    if ctx.consumer:
-        ctx.consumer.cleanup(ctx)
+        run(ctx)
+
+        if ctx.consumer:
+            ctx.consumer.cleanup(ctx)
+
+        for sctx in ctx.subcontexts:
+            for stream in sctx.streams:
+                unmap_buffers(stream)
+    finally:
+        # Write the frames that are still pending, also on errors and Ctrl-C
+        if ctx.saver:
+            ctx.saver.stop()
 
     return 0
 
@@ -2,9 +2,10 @@ from __future__ import annotations
 import importlib
 import mmap
 import os
+import queue
 import sys
-import typing
-from typing import TYPE_CHECKING
+import threading
+from typing import Collection, TYPE_CHECKING
 
 import v4l2
 import v4l2.uapi
@@ -15,18 +16,20 @@ if TYPE_CHECKING:
     from .cam import Subcontext
     import kms
 
-# Disable all possible links
-def disable_all_links(md: v4l2.MediaDevice):
+# Disable all enabled links, except the ones in 'keep'
+def disable_all_links(md: v4l2.MediaDevice, keep: Collection[v4l2.MediaLink] = ()):
     for ent in md.entities:
         for l in ent.pad_links:
-            if l.is_immutable:
+            # Each link is seen from both of its entities. Skipping the already
+            # disabled links also avoids disabling the same link twice.
+            if l.is_immutable or not l.is_enabled or l in keep:
                 continue
             #print(l)
             l.disable()
 
 
-# Enable link between (src_ent, src_pad) -> (sink_ent, sink_pad)
-def enable_link(source, sink):
+# Find link between (src_ent, src_pad) -> (sink_ent, sink_pad)
+def find_link(source, sink) -> v4l2.MediaLink:
     src_ent = source[0]
     sink_ent = sink[0]
 
@@ -35,28 +38,11 @@ def enable_link(source, sink):
     #links = src_ent.get_links(source[1])
     links = source_pad.links
 
-    link = None
-
     for l in links:
         if l.sink_pad.entity == sink_ent and l.sink_pad.index == sink[1]:
-            link = l
-            break
-
-    if link is None:
-        raise RuntimeError('Failed to find link between', source, sink)
-
-    #if link.is_enabled:
-    #    return
-
-    #print('CONF')
-
-    if link.is_immutable:
-        return
+            return l
 
-    link.enabled = True
-    #src_ent.setup_link(link)
-
-    link.enable()
+    raise RuntimeError('Failed to find link between', source, sink)
 
 
 #
@@ -141,6 +127,8 @@ def setup_links(sctx: Subcontext, config):
     md = sctx.md
     assert md is not None
 
+    links = []
+
     for l in config.get('links', []):
         source_ent, source_pad = l['src']
         sink_ent, sink_pad = l['dst']
@@ -156,14 +144,31 @@ def setup_links(sctx: Subcontext, config):
                 if sink_ent is None:
                     raise RuntimeError(f'Failed to find entity {l["dst"]}')
 
-            if sctx.ctx.verbose:
-                print(f'Link {source_ent.name} -> {sink_ent.name}')
-
-            enable_link((source_ent, source_pad), (sink_ent, sink_pad))
+            links.append(find_link((source_ent, source_pad), (sink_ent, sink_pad)))
         except Exception as e:
             print('Failed to link {} -> {}'.format((source_ent, source_pad), (sink_ent, sink_pad)))
             raise e
 
+    # Disable the other links first, as they might conflict with the links
+    # to be enabled. Links that are already disabled are left alone.
+    disable_all_links(md, keep=set(links))
+
+    for link in links:
+        if sctx.ctx.verbose:
+            print(f'Link {link.source_pad.entity.name} -> {link.sink_pad.entity.name}')
+
+        # Enable also the links that look enabled. The flags are a snapshot,
+        # and another subcontext on the same media device may have disabled
+        # the link since.
+        if link.is_immutable:
+            continue
+
+        try:
+            link.enable()
+        except Exception:
+            print('Failed to link {} -> {}'.format(link.source_pad, link.sink_pad))
+            raise
+
 # Configure entities
 def configure_subdevs(sctx: Subcontext, config):
     ctx = sctx.ctx
@@ -245,22 +250,89 @@ def configure_subdevs(sctx: Subcontext, config):
     return subdevices
 
 
-def save_fb_to_file(stream: Stream, is_drm, fb_or_vbuf):
-    cap = stream.cap
+class FrameSaver:
+    """Writes saved frames to files in a separate thread"""
 
-    filename = 'frame-{}-{}.data'.format(stream.id, stream.total_num_frames)
-    print('save to ' + filename)
+    def __init__(self, max_pending: int):
+        # put() blocks if the writer falls behind, instead of buffering
+        # an unbounded number of frame copies
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error: OSError | None = None
+        self.thread = threading.Thread(target=self.main, daemon=True)
+        self.thread.start()
 
-    if is_drm:
-        fb: kms.DumbFramebuffer = fb_or_vbuf
+    def save(self, filename: str, data: bytes):
+        if self.error:
+            raise RuntimeError('Failed to save frames') from self.error
 
-        with mmap.mmap(fb.fd(0), fb.size(0), mmap.MAP_SHARED, mmap.PROT_READ) as b:
-            with open(filename, 'wb') as f:
-                f.write(b)
-    else:
-        vbuf = typing.cast(v4l2.VideoBuffer, fb_or_vbuf)
+        self.queue.put((filename, data))
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def main(self):
+        while True:
+            item = self.queue.get()
+            if not item:
+                break
+
+            # After a failure, keep draining the queue so that save() and
+            # stop() don't block
+            if self.error:
+                continue
+
+            filename, data = item
+
+            try:
+                with open(filename, 'wb') as f:
+                    f.write(data)
+            except OSError as e:
+                print(f'Failed to write {filename}: {e}')
+                self.error = e
+                continue
+
+            print('save to ' + filename)
+
+
+def map_buffer(stream: Stream, is_drm, vbuf: v4l2.VideoBuffer) -> mmap.mmap:
+    """Returns a mapping of the buffer, shared by the frame saving and the network sending"""
+
+    # Map each buffer on first use and keep the mapping for the following
+    # frames. The MMAP offset is known only after the buffer has been
+    # dequeued once.
+    b = stream.buf_maps[vbuf.index]
+
+    if b is None:
+        if is_drm:
+            # The DMABUF vbufs were reserved in stream.fbs order
+            fb: kms.DumbFramebuffer = stream.fbs[vbuf.index]
+
+            b = mmap.mmap(fb.fd(0), fb.size(0), mmap.MAP_SHARED, mmap.PROT_READ)
+        else:
+            cap = stream.cap
+
+            # Need PROT_WRITE to be able to read fe-config buffers
+            b = mmap.mmap(cap.fd, cap.framesize, mmap.MAP_SHARED,
+                          mmap.PROT_READ | mmap.PROT_WRITE, offset=vbuf.offset)
+
+        stream.buf_maps[vbuf.index] = b
+
+    return b
+
+
+def unmap_buffers(stream: Stream):
+    for i, b in enumerate(stream.buf_maps):
+        if b is not None:
+            b.close()
+            stream.buf_maps[i] = None
+
+
+def save_fb_to_file(saver: FrameSaver, stream: Stream, is_drm, vbuf: v4l2.VideoBuffer):
+    filename = 'frame-{}-{}.data'.format(stream.id, stream.total_num_frames)
+
+    b = map_buffer(stream, is_drm, vbuf)
 
-        with mmap.mmap(cap.fd, cap.framesize, mmap.MAP_SHARED, mmap.PROT_READ,
-                       offset=vbuf.offset) as b:
-            with open(filename, 'wb') as f:
-                f.write(b)
+    # Copy the frame, so that the buffer can be queued back to the camera
+    # while the file is written
+    saver.save(filename, bytes(b))
@@ -22,9 +22,10 @@ class KmsStream:
     dst_h: int
     dst_x: int
     dst_y: int
-    old_fb: kms.DumbFramebuffer | None
+    old_vbuf: v4l2.VideoBuffer | None
+    vbuf: v4l2.VideoBuffer
     fb: kms.DumbFramebuffer
-    fb_queue: deque
+    vbuf_queue: deque[v4l2.VideoBuffer]
     plane: kms.Plane
 
 class DisplayConsumer(Consumer):
@@ -50,6 +51,8 @@ class DisplayConsumer(Consumer):
         res = None
         crtc = None
         mode = None
+        hdisplay = 0
+        vdisplay = 0
         if ctx.use_display:
             res = kms.ResourceManager(card)
             conn = res.reserve_connector()
@@ -57,6 +60,9 @@ class DisplayConsumer(Consumer):
             mode = conn.get_default_mode()
             modeb = mode.to_blob(card)
 
+            hdisplay = mode.hdisplay
+            vdisplay = mode.vdisplay
+
             self.crtc = crtc
             self.conn = conn
             self.modeb = modeb
@@ -129,8 +135,8 @@ class DisplayConsumer(Consumer):
 
             if stream.display:
                 assert mode is not None
-                max_w = mode.hdisplay // (1 if num_planes == 1 else 2)
-                max_h = mode.vdisplay // (1 if num_planes <= 2 else 2)
+                max_w = hdisplay // (1 if num_planes == 1 else 2)
+                max_h = vdisplay // (1 if num_planes <= 2 else 2)
 
                 kms_stream.src_w = min(kms_stream.buf_w, max_w)
                 kms_stream.src_h = min(kms_stream.buf_h, max_h)
@@ -143,12 +149,12 @@ class DisplayConsumer(Consumer):
                 if display_idx % 2 == 0:
                     kms_stream.dst_x = 0
                 else:
-                    kms_stream.dst_x = mode.hdisplay - kms_stream.dst_w
+                    kms_stream.dst_x = hdisplay - kms_stream.dst_w
 
                 if display_idx // 2 == 0:
                     kms_stream.dst_y = 0
                 else:
-                    kms_stream.dst_y = mode.vdisplay - kms_stream.dst_h
+                    kms_stream.dst_y = vdisplay - kms_stream.dst_h
 
                 display_idx += 1
 
@@ -212,9 +218,14 @@ class DisplayConsumer(Consumer):
             'CRTC_H': kms_stream.dst_h,
         })
 
-        kms_stream.old_fb = None
+        kms_stream.old_vbuf = None
+        kms_stream.vbuf = stream.cap.vbuffers[0]
         kms_stream.fb = fb
-        kms_stream.fb_queue = deque()
+        # One buffer is on the screen and one waits to be requeued after the
+        # next flip. With num_bufs >= 4 this leaves at least one buffer for
+        # the camera. With fewer buffers the queue still holds one frame, and
+        # the capture stalls until the pending flip completes.
+        kms_stream.vbuf_queue = deque(maxlen=max(1, stream.num_bufs - 3))
 
     def setup_streams_done(self, ctx: Context):
         if ctx.use_display:
@@ -244,17 +255,17 @@ class DisplayConsumer(Consumer):
 
         kms_stream = self.kms_streams[stream.id]
 
-        fb = None
+        assert ctx.buf_type == 'drm'
 
-        if ctx.buf_type == 'drm':
-            fb = next((fb for fb in stream.fbs if fb.fd(0) == vbuf.fd), None)
-            assert fb is not None
+        vbuf_queue = kms_stream.vbuf_queue
 
-        assert fb is not None
-        kms_stream.fb_queue.append(fb)
+        # If the display can't keep up, drop the oldest frame and give its
+        # buffer back to the camera so that the capture doesn't stall
+        if len(vbuf_queue) == vbuf_queue.maxlen:
+            print('WARNING vbuf_queue full, dropping a frame')
+            stream.cap.queue(vbuf_queue.popleft())
 
-        if len(kms_stream.fb_queue) >= stream.num_bufs - 1:
-            print('WARNING fb_queue {}'.format(len(kms_stream.fb_queue)))
+        vbuf_queue.append(vbuf)
 
         if not self.committed:
             self.handle_pageflip()
@@ -266,40 +277,40 @@ class DisplayConsumer(Consumer):
 
         self.committed = False
 
-        req = kms.AtomicReq(self.card)
-
-        do_commit = False
+        # Only create the request if there's a new fb to show
+        req = None
 
         for kms_stream in self.kms_streams.values():
             stream = kms_stream.stream
 
             cap = stream.cap
 
-            if kms_stream.old_fb:
-                fb = kms_stream.old_fb
+            old_vbuf = kms_stream.old_vbuf
 
-                # XXX we should just track the vbufs in streams, instead of looking
-                # for the vbuf based on the drm fb
-                vbuf = next(vbuf for vbuf in cap.vbuffers if vbuf.fd == fb.fd(0))
+            if old_vbuf:
+                cap.queue(old_vbuf)
+                kms_stream.old_vbuf = None
 
-                cap.queue(vbuf)
-                kms_stream.old_fb = None
+            vbuf_queue = kms_stream.vbuf_queue
 
-            if len(kms_stream.fb_queue) == 0:
+            if not vbuf_queue:
                 continue
 
-            kms_stream.old_fb = kms_stream.fb
+            kms_stream.old_vbuf = kms_stream.vbuf
 
-            fb = kms_stream.fb_queue.popleft()
-            kms_stream.fb = fb
+            vbuf = vbuf_queue.popleft()
+            kms_stream.vbuf = vbuf
 
-            plane = kms_stream.plane
+            # The DMABUF vbufs were reserved in stream.fbs order
+            fb = stream.fbs[vbuf.index]
+            kms_stream.fb = fb
 
-            req.add(plane, 'FB_ID', fb.id)
+            if req is None:
+                req = kms.AtomicReq(self.card)
 
-            do_commit = True
+            req.add(kms_stream.plane, 'FB_ID', fb.id)
 
-        if do_commit:
+        if req is not None:
             req.commit(allow_modeset = False)
             self.committed = True
 
@@ -312,4 +323,4 @@ class DisplayConsumer(Consumer):
         pass
 
     def register_selector(self, sel: BaseSelector):
-        sel.register(self.card.fd, EVENT_READ, lambda: self.readdrm())
+        sel.register(self.card.fd, EVENT_READ, self.readdrm)
@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import mmap
 import queue
 import socket
 import struct
@@ -8,6 +7,7 @@ import threading
 
 from v4l2 import MetaFormat
 
+from cam_helpers import map_buffer
 from cam_types import Stream, Context, Consumer
 
 class NetConsumer(Consumer):
@@ -21,9 +21,11 @@ class NetConsumer(Consumer):
         self.net_done_queue = queue.Queue()
         self.net_thread = None
         self.current_buf = { }
+        self.headers: dict[int, bytes] = {}
 
     def setup_stream(self, ctx: Context, stream: Stream) -> bool:
         self.current_buf[stream.id] = None
+        self.headers[stream.id] = self.pack_header(stream)
         return False
 
     def setup_streams_done(self, ctx: Context):
@@ -67,11 +69,13 @@ class NetConsumer(Consumer):
             cap = stream.cap
             cap.queue(vbuf)
 
-    def tx(self, stream: Stream, vbuf, is_drm):
+    @staticmethod
+    def pack_header(stream: Stream):
         cap = stream.cap
 
-        plane_sizes = cap.buffersizes
-        strides = cap.strides
+        # Copy the lists, as the streamer may return its internal lists
+        plane_sizes = list(cap.buffersizes)
+        strides = list(cap.strides)
 
         # Extend lists to 4 elements
         plane_sizes.extend(0 for _ in range(4 - len(plane_sizes)))
@@ -84,7 +88,7 @@ class NetConsumer(Consumer):
         else:
             num_planes = len(fmt.planes)
 
-        hdr = NetConsumer.struct_fmt.pack(
+        return NetConsumer.struct_fmt.pack(
             stream.id,
             stream.w,
             stream.h,
@@ -94,21 +98,9 @@ class NetConsumer(Consumer):
             *plane_sizes,
         )
 
-        self.sock.sendall(hdr)
+    def tx(self, stream: Stream, vbuf, is_drm):
+        self.sock.sendall(self.headers[stream.id])
 
-        if is_drm:
-            fb = next((fb for fb in stream.fbs if fb.fd(0) == vbuf.fd), None)
-            assert fb is not None
+        b = map_buffer(stream, is_drm, vbuf)
 
-            with mmap.mmap(fb.fd(0), fb.size(0), mmap.MAP_SHARED, mmap.PROT_READ) as b:
-                self.sock.sendall(b)
-        else:
-            # Need PROT_WRITE to be able to read fe-config buffers
-            with mmap.mmap(
-                cap.fd,
-                cap.framesize,
-                mmap.MAP_SHARED,
-                mmap.PROT_READ | mmap.PROT_WRITE,
-                offset=vbuf.offset,
-            ) as b:
-                self.sock.sendall(b)
+        self.sock.sendall(b)
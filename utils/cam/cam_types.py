@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+import mmap
 from selectors import BaseSelector
-from typing import Callable
+from typing import Callable, TYPE_CHECKING
 import types
 
 from kms import DumbFramebuffer
@@ -11,6 +12,9 @@ import v4l2
 from v4l2 import PixelFormat, MetaFormat
 from v4l2.videodev import CaptureStreamer, VideoDevice
 
+if TYPE_CHECKING:
+    from cam_helpers import FrameSaver
+
 
 pix_or_meta_fmt = PixelFormat | MetaFormat
 
@@ -35,6 +39,7 @@ class Stream:
     device: tuple[str, str]
     cap: CaptureStreamer
     fbs: list[DumbFramebuffer] # XXX used from cam_net...
+    buf_maps: list[mmap.mmap | None] # Buffer mappings, indexed by vbuf.index
     total_num_frames: int
     last_framenum: int
     last_timestamp: float
@@ -62,10 +67,12 @@ class Context:
     config_only: bool
     delay: int
     save: bool
+    saver: None | FrameSaver
     tx: None | list[str]
     run_ipython: Callable
     exit: bool
     exit_num_frames: int
+    cpus: None | set[int]
 
     net_host: str
     net_port: int
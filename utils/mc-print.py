@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import argparse
+from collections import deque
 import errno
 import textwrap
 import sys
@@ -8,41 +9,41 @@ import sys
 import v4l2
 import v4l2.uapi
 
-def print_selection(subdev, pad, stream, target):
+def print_selection(out, subdev, pad, stream, target):
     name = target.name.lower()
 
     try:
         r = subdev.get_selection(target.value, pad.index, stream)
-        print(f'      {name}:({r.left},{r.top})/{r.width}✕{r.height}')
+        out.append(f'      {name}:({r.left},{r.top})/{r.width}✕{r.height}')
     except OSError as e:
         if e.errno not in (errno.ENOTTY, errno.EINVAL):
-            print(f'      {name}:({e})')
+            out.append(f'      {name}:({e})')
 
 
-def print_selections(subdev, pad, stream):
-    print_selection(subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.NATIVE_SIZE)
-    print_selection(subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.CROP_BOUNDS)
-    print_selection(subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.CROP_DEFAULT)
-    print_selection(subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.CROP)
-    print_selection(subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.COMPOSE_BOUNDS)
-    print_selection(subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.COMPOSE_DEFAULT)
-    print_selection(subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.COMPOSE)
-    print_selection(subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.COMPOSE_PADDED)
+def print_selections(out, subdev, pad, stream):
+    print_selection(out, subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.NATIVE_SIZE)
+    print_selection(out, subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.CROP_BOUNDS)
+    print_selection(out, subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.CROP_DEFAULT)
+    print_selection(out, subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.CROP)
+    print_selection(out, subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.COMPOSE_BOUNDS)
+    print_selection(out, subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.COMPOSE_DEFAULT)
+    print_selection(out, subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.COMPOSE)
+    print_selection(out, subdev, pad, stream, v4l2.uapi.v4l2_sel_tgt.COMPOSE_PADDED)
 
 
-def print_routes(subdev):
+def print_routes(out, subdev):
     routes = subdev.get_routes()
     if not routes:
         return
 
-    print('  Routing:')
+    out.append('  Routing:')
     for r in routes:
-        print('    {}/{} -> {}/{} [{}]'.format(r.sink_pad, r.sink_stream,
-                                               r.source_pad, r.source_stream,
-                                               v4l2.RouteFlag(r.flags).name))
+        out.append('    {}/{} -> {}/{} [{}]'.format(r.sink_pad, r.sink_stream,
+                                                    r.source_pad, r.source_stream,
+                                                    v4l2.RouteFlag(r.flags).name))
 
 
-def print_videodev_pad(videodev, print_supported):
+def print_videodev_pad(out, videodev, print_supported):
     def print_videodef_fmts(videodev, buftype, title,):
         fmts = videodev.get_formats(buftype)
         fmts = [f"{f.name} ('{v4l2.fourcc_to_str(f.v4l2_fourcc)}')" for f in fmts]
@@ -59,17 +60,17 @@ def print_videodev_pad(videodev, print_supported):
         fmts = (f'{title}: {fmts}')
         fmts = textwrap.fill(fmts, width=100, initial_indent=' ' * 4,
                              subsequent_indent=' ' * (4 + len(title) + 2))
-        print(fmts)
+        out.append(fmts)
 
     if videodev.has_capture:
         try:
             fmt = videodev.get_format(v4l2.BufType.VIDEO_CAPTURE)
             f = fmt.fmt.pix
             fmt = f'{f.width}x{f.height}/{v4l2.fourcc_to_str(f.pixelformat)}'
-            print(f'    vcap: {fmt}')
+            out.append(f'    vcap: {fmt}')
         except OSError as e:
             if e.errno != errno.ENOTTY:
-                print(f'    <{e}>')
+                out.append(f'    <{e}>')
 
         if print_supported:
             print_videodef_fmts(videodev, v4l2.BufType.VIDEO_CAPTURE, 'vcap')
@@ -79,10 +80,10 @@ def print_videodev_pad(videodev, print_supported):
             fmt = videodev.get_format(v4l2.BufType.VIDEO_CAPTURE_MPLANE)
             f = fmt.fmt.pix_mp
             fmt = f'{f.width}x{f.height}/{v4l2.fourcc_to_str(f.pixelformat)} numplanes:{f.num_planes}'
-            print(f'    vcapm: {fmt}')
+            out.append(f'    vcapm: {fmt}')
         except OSError as e:
             if e.errno != errno.ENOTTY:
-                print(f'    <{e}>')
+                out.append(f'    <{e}>')
 
         if print_supported:
             print_videodef_fmts(videodev, v4l2.BufType.VIDEO_CAPTURE_MPLANE, 'vcapm')
@@ -92,10 +93,10 @@ def print_videodev_pad(videodev, print_supported):
             fmt = videodev.get_format(v4l2.BufType.META_CAPTURE)
             f = fmt.fmt.meta
             fmt = f'{f.buffersize}/{v4l2.fourcc_to_str(f.dataformat)}'
-            print(f'    mcap: {fmt}')
+            out.append(f'    mcap: {fmt}')
         except OSError as e:
             if e.errno != errno.ENOTTY:
-                print(f'    <{e}>')
+                out.append(f'    <{e}>')
 
         if print_supported:
             print_videodef_fmts(videodev, v4l2.BufType.META_CAPTURE, 'mcap')
@@ -105,16 +106,16 @@ def print_videodev_pad(videodev, print_supported):
             fmt = videodev.get_format(v4l2.BufType.META_OUTPUT)
             f = fmt.fmt.meta
             fmt = f'{f.buffersize}/{v4l2.fourcc_to_str(f.dataformat)}'
-            print(f'    mout: {fmt}')
+            out.append(f'    mout: {fmt}')
         except OSError as e:
             if e.errno != errno.ENOTTY:
-                print(f'    <{e}>')
+                out.append(f'    <{e}>')
 
         if print_supported:
             print_videodef_fmts(videodev, v4l2.BufType.META_OUTPUT, 'mout')
 
 
-def print_streams(subdev, pad, streams, print_supported):
+def print_streams(out, subdev, pad, streams, print_supported):
     for s in streams:
         try:
             fmt = subdev.get_format(pad.index, s)
@@ -125,21 +126,21 @@ def print_streams(subdev, pad, streams, print_supported):
             except ValueError:
                 bfmt = f'0x{f.code:x}'
 
-            print(f'    Stream{s} {f.width}✕{f.height}/{bfmt} field:{f.field} colorspace:{f.colorspace} quantization:{f.quantization} xfer:{f.xfer_func} flags:{f.flags}')
+            out.append(f'    Stream{s} {f.width}✕{f.height}/{bfmt} field:{f.field} colorspace:{f.colorspace} quantization:{f.quantization} xfer:{f.xfer_func} flags:{f.flags}')
         except OSError as e:
             if e.errno != errno.ENOTTY:
-                print(f'    Stream{s} <{e}>')
+                out.append(f'    Stream{s} <{e}>')
 
         try:
             ival = subdev.get_frame_interval(pad.index, s)
             if ival[0] == 0:
                 ival = (1, 0)
-            print(f'            Interval {ival[0]}/{ival[1]} = {ival[1] / ival[0]} fps')
+            out.append(f'            Interval {ival[0]}/{ival[1]} = {ival[1] / ival[0]} fps')
         except OSError as e:
             if e.errno != errno.ENOTTY:
-                print(f'            Interval {e}')
+                out.append(f'            Interval {e}')
 
-        print_selections(subdev, pad, s)
+        print_selections(out, subdev, pad, s)
 
         if print_supported:
             codes = subdev.get_formats(pad.index, s)
@@ -155,17 +156,17 @@ def print_streams(subdev, pad, streams, print_supported):
 
                 codes = textwrap.fill(codes, width=100, initial_indent=' ' * 6,
                                      subsequent_indent=' ' * (7 + 6))
-                print(codes)
+                out.append(codes)
 
 
-def print_pads(ent, subdev, videodev, only_graph: bool, print_supported):
+def print_pads(out, ent, subdev, videodev, only_graph: bool, print_supported):
     if subdev:
         routes = [r for r in subdev.get_routes() if r.is_active]
     else:
         routes = None
 
     for pad in ent.pads:
-        links = list([l for l in pad.links if l.is_enabled])
+        links = [l for l in pad.links if l.is_enabled]
 
         # Don't show external pads that have no enabled links
         #if len(links) == 0 and not pad.is_internal:
@@ -178,38 +179,35 @@ def print_pads(ent, subdev, videodev, only_graph: bool, print_supported):
             link = links[0]
             remote_pad = link.source_pad if link.sink_pad == pad else link.sink_pad
             link_fmt = f"{link_dir} '{remote_pad.entity.name}':{remote_pad.index} [{v4l2.MediaLinkFlag(link.flags).name}]"
-            print(f'  Pad{pad.index} [{pad.flags.name}] {link_fmt}')
+            out.append(f'  Pad{pad.index} [{pad.flags.name}] {link_fmt}')
         else:
-            print(f'  Pad{pad.index} [{pad.flags.name}]')
+            out.append(f'  Pad{pad.index} [{pad.flags.name}]')
 
             for link in links:
                 remote_pad = link.source_pad if link.sink_pad == pad else link.sink_pad
-                print(f"      {link_dir} '{remote_pad.entity.name}':{remote_pad.index} [{v4l2.MediaLinkFlag(link.flags).name}]")
+                out.append(f"      {link_dir} '{remote_pad.entity.name}':{remote_pad.index} [{v4l2.MediaLinkFlag(link.flags).name}]")
 
         if routes:
-            streams = set([r.source_stream for r in routes if r.source_pad == pad.index] + [r.sink_stream for r in routes if r.sink_pad == pad.index])
+            streams = {r.source_stream for r in routes if r.source_pad == pad.index} | {r.sink_stream for r in routes if r.sink_pad == pad.index}
         else:
             streams = [ 0 ]
 
         streams = sorted(streams)
 
         if not only_graph and videodev:
-            print_videodev_pad(videodev, print_supported)
+            print_videodev_pad(out, videodev, print_supported)
 
         if not only_graph and subdev:
-            print_streams(subdev, pad, streams, print_supported)
+            print_streams(out, subdev, pad, streams, print_supported)
 
 
-def print_entity(ent, only_graph: bool, print_supported):
-    print(f"Entity {ent.id}: '{ent.name}', Function: {ent.function.name}", end='')
+def print_entity(out, ent, only_graph: bool, print_supported):
+    line = f"Entity {ent.id}: '{ent.name}', Function: {ent.function.name}"
     if ent.interface:
-        print(f', Interface: {ent.interface.intf_type.name}', end='')
+        line += f', Interface: {ent.interface.intf_type.name}'
         if ent.interface.dev_path:
-            print(f', Path: {ent.interface.dev_path}')
-        else:
-            print()
-    else:
-        print()
+            line += f', Path: {ent.interface.dev_path}'
+    out.append(line)
 
     if ent.interface and ent.interface.is_subdev:
         subdev = v4l2.SubDevice(ent.interface.dev_path)
@@ -221,12 +219,12 @@ def print_entity(ent, only_graph: bool, print_supported):
     else:
         videodev = None
 
-    print_pads(ent, subdev, videodev, only_graph, print_supported)
+    print_pads(out, ent, subdev, videodev, only_graph, print_supported)
 
     if not only_graph and subdev:
-        print_routes(subdev)
+        print_routes(out, subdev)
 
-    print()
+    out.append('')
 
 
 def main():
@@ -248,45 +246,52 @@ def main():
         pat = args.pattern.lower()
 
         entities = [ent for ent in md.entities if pat in ent.name.lower() or pat in (ent.interface.dev_path if ent.interface else '')]
-        print_queue = entities
+        print_queue = deque(entities)
         recurse = False
     else:
         entities = list(md.entities)
 
         # start with source-only subdevs (sensors)
-        print_queue = sorted([ent for ent in entities if not any(p.is_sink and not p.is_internal for p in ent.pads)], key=lambda e: e.name)
+        print_queue = deque(sorted([ent for ent in entities if not any(p.is_sink and not p.is_internal for p in ent.pads)], key=lambda e: e.name))
 
         recurse = True
 
     def flatten(t):
         return [item for sublist in t for item in sublist]
 
-    print(f'Driver: {md.driver}, Model: {md.model}, Bus info: {md.bus_info}')
-    print()
+    # Collect the output and print it in one go at the end. Print also on
+    # errors, so that the output up to the failing entity is shown.
+    out = [
+        f'Driver: {md.driver}, Model: {md.model}, Bus info: {md.bus_info}',
+        '',
+    ]
 
     printed = set()
 
-    while len(print_queue) > 0:
-        ent = print_queue.pop(0)
+    try:
+        while print_queue:
+            ent = print_queue.popleft()
 
-        if ent in printed:
-            continue
+            if ent in printed:
+                continue
 
-        printed.add(ent)
+            printed.add(ent)
 
-        if recurse:
-            if args.all:
-                links = flatten([ p.links for p in ent.pads ])
+            if recurse:
+                if args.all:
+                    links = flatten([ p.links for p in ent.pads ])
 
-                print_queue += [ l.sink_pad.entity for l in links ]
-                print_queue += [ l.source_pad.entity for l in links ]
-            else:
-                links = flatten([ p.links for p in ent.pads if p.is_source ])
-                links = [l for l in links if l.is_enabled]
+                    print_queue += [ l.sink_pad.entity for l in links ]
+                    print_queue += [ l.source_pad.entity for l in links ]
+                else:
+                    links = flatten([ p.links for p in ent.pads if p.is_source ])
+                    links = [l for l in links if l.is_enabled]
 
-                print_queue += [ l.sink_pad.entity for l in links ]
+                    print_queue += [ l.sink_pad.entity for l in links ]
 
-        print_entity(ent, only_graph=args.graph, print_supported=args.supported)
+            print_entity(out, ent, only_graph=args.graph, print_supported=args.supported)
+    finally:
+        print(str.join('\n', out))
 
     return 0
 
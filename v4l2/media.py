@@ -4,8 +4,9 @@ import ctypes
 import fcntl
 import weakref
 import os
-import glob
 import fnmatch
+from functools import cached_property
+from typing import ClassVar
 import v4l2.uapi
 from .helpers import filepath_for_major_minor
 from .enums import MediaEntityFunction, MediaLinkFlag, MediaPadFlag, MediaInterfaceType
@@ -33,7 +34,7 @@ class MediaObject:
         self.id = id
 
     def _finalize(self):
-        self.links = [l for l in self.md.links if self.id in (l.media_link.source_id, l.media_link.sink_id)]
+        self.links = self.md.find_links(self.id)
 
 
 class MediaEntity(MediaObject):
@@ -48,7 +49,7 @@ class MediaEntity(MediaObject):
 
     def _finalize(self):
         super()._finalize()
-        self.pads = [p for p in self.md.pads if p.media_pad.entity_id == self.id]
+        self.pads = self.md.find_pads(self.id)
 
         ifaces = []
 
@@ -88,7 +89,6 @@ class MediaInterface(MediaObject):
         super().__init__(md, media_iface.id)
         self.media_iface = media_iface
         self.majorminor = (self.media_iface.unnamed_1.devnode.major, self.media_iface.unnamed_1.devnode.minor)
-        self.dev_path = filepath_for_major_minor(*self.majorminor)
         self.intf_type = MediaInterfaceType(self.media_iface.intf_type)
 
     def _finalize(self):        # pylint: disable=useless-parent-delegation
@@ -97,6 +97,11 @@ class MediaInterface(MediaObject):
     def __repr__(self) -> str:
         return f'MediaInterface({self.id})'
 
+    # Resolving the path reads sysfs, so do it only for the interfaces that are used
+    @cached_property
+    def dev_path(self) -> str:
+        return filepath_for_major_minor(*self.majorminor)
+
     @property
     def is_subdev(self):
         return self.media_iface.intf_type == v4l2.uapi.MEDIA_INTF_T_V4L_SUBDEV
@@ -115,7 +120,9 @@ class MediaPad(MediaObject):
 
     def _finalize(self):
         super()._finalize()
-        self.entity = next(e for e in self.md.entities if e.id == self.media_pad.entity_id)
+        entity = self.md.find_id(self.media_pad.entity_id)
+        assert isinstance(entity, MediaEntity)
+        self.entity = entity
 
     def __repr__(self) -> str:
         return f"MediaPad({self.id}, '{self.entity.name}':{self.index})"
@@ -186,8 +193,11 @@ class MediaLink(MediaObject):
 
     def _finalize(self):
         super()._finalize()
-        self.source = next(e for e in self.md.objects if e.id == self.media_link.source_id)
-        self.sink = next(e for e in self.md.objects if e.id == self.media_link.sink_id)
+        source = self.md.find_id(self.media_link.source_id)
+        sink = self.md.find_id(self.media_link.sink_id)
+        assert source and sink
+        self.source = source
+        self.sink = sink
 
     def __repr__(self) -> str:
         return f'MediaLink({self.id}, {self.source}->{self.sink})'
@@ -232,36 +242,85 @@ class MediaLink(MediaObject):
 
 
 class MediaDevice:
+    # (key, value) -> path of the media device found with that lookup
+    __path_cache: ClassVar[dict[tuple[str, str], str]] = {}
+
     def __init__(self, name: str, key: str = 'path') -> None:
         if key != 'path':
-            name = MediaDevice.__find_media_device_by_value(key, name)
-            key = 'path'
+            # Use the fd opened for the lookup instead of opening the device again
+            self.fd = MediaDevice.__open_media_device_by_value(key, name)
+        else:
+            self.fd = os.open(name, os.O_RDWR | os.O_NONBLOCK)
 
-        self.fd = os.open(name, os.O_RDWR | os.O_NONBLOCK)
         self.__read_device_info()
         self.__read_topology()
 
         weakref.finalize(self, os.close, self.fd)
 
     @staticmethod
-    def __find_media_device_by_value(key: str, value: str) -> str:
-        for path in glob.glob('/dev/media*'):
-            try:
-                fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
-            except OSError:
-                continue
-
-            try:
-                mdi = v4l2.uapi.media_device_info()
-                fcntl.ioctl(fd, v4l2.uapi.MEDIA_IOC_DEVICE_INFO, mdi, True)
-
-                device_val = getattr(mdi, key).decode()
-
-                if fnmatch.fnmatch(device_val, value):
-                    return path
-            finally:
+    def __open_if_matches(path: str, key: str, value: str) -> int | None:
+        """Returns an open fd to the media device, or None if it doesn't match"""
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+        except OSError:
+            return None
+
+        matches = False
+
+        try:
+            mdi = v4l2.uapi.media_device_info()
+            fcntl.ioctl(fd, v4l2.uapi.MEDIA_IOC_DEVICE_INFO, mdi, True)
+
+            device_val = getattr(mdi, key).decode()
+
+            matches = fnmatch.fnmatch(device_val, value)
+        finally:
+            if not matches:
                 os.close(fd)
 
+        return fd if matches else None
+
+    @staticmethod
+    def __sysfs_model_may_match(path: str, value: str) -> bool:
+        name = os.path.basename(path)
+
+        try:
+            with open(f'/sys/bus/media/devices/{name}/model', encoding='utf-8') as f:
+                model = f.read().rstrip('\n')
+        except OSError:
+            # No sysfs info, the device needs to be probed
+            return True
+
+        return fnmatch.fnmatch(model, value)
+
+    @staticmethod
+    def __open_media_device_by_value(key: str, value: str) -> int:
+        cache_key = (key, value)
+
+        # The device nodes may have changed since the path was cached, so
+        # check the cached device before using it
+        path = MediaDevice.__path_cache.get(cache_key)
+        if path:
+            fd = MediaDevice.__open_if_matches(path, key, value)
+            if fd is not None:
+                return fd
+
+        with os.scandir('/dev') as it:
+            paths = [e.path for e in it if e.name.startswith('media')]
+
+        # The model is also available in sysfs, so skip the nodes that
+        # cannot match without opening them
+        if key == 'model':
+            paths = [p for p in paths if MediaDevice.__sysfs_model_may_match(p, value)]
+
+        for path in paths:
+            fd = MediaDevice.__open_if_matches(path, key, value)
+            if fd is not None:
+                MediaDevice.__path_cache[cache_key] = path
+                return fd
+
+        MediaDevice.__path_cache.pop(cache_key, None)
+
         raise FileNotFoundError(f'No media device "{key}" = "{value}" found')
 
     def get_device_info(self):
@@ -308,35 +367,66 @@ class MediaDevice:
 
         self.topology = MediaTopology(topology, entities, interfaces, pads, links)
 
-        self.objects = \
-            [MediaEntity(self, e) for e in self.topology.entities] + \
-            [MediaInterface(self, i) for i in self.topology.interfaces] + \
-            [MediaPad(self, p) for p in self.topology.pads] + \
-            [MediaLink(self, l) for l in self.topology.links]
+        self.__entities = [MediaEntity(self, e) for e in self.topology.entities]
+        self.__interfaces = [MediaInterface(self, i) for i in self.topology.interfaces]
+        self.__pads = [MediaPad(self, p) for p in self.topology.pads]
+        self.__links = [MediaLink(self, l) for l in self.topology.links]
+
+        self.objects: list[MediaObject] = [*self.__entities, *self.__interfaces,
+                                           *self.__pads, *self.__links]
+
+        # Index the objects and links for the _finalize() passes below, so
+        # that they don't need to scan all the objects for every object
+        self.__objects_by_id = {o.id: o for o in self.objects}
+
+        # Reversed, so that the first entity wins if a name is not unique
+        self.__entities_by_name = {e.name: e for e in reversed(self.__entities)}
+
+        self.__links_by_id: dict[int, list[MediaLink]] = {}
+        for l in self.__links:
+            ids = {l.media_link.source_id, l.media_link.sink_id}
+            for id in ids:
+                self.__links_by_id.setdefault(id, []).append(l)
+
+        self.__pads_by_entity_id: dict[int, list[MediaPad]] = {}
+        for p in self.__pads:
+            self.__pads_by_entity_id.setdefault(p.media_pad.entity_id, []).append(p)
 
         for o in self.objects:
             o._finalize()       # pylint: disable=protected-access
 
     @property
     def entities(self):
-        yield from [o for o in self.objects if isinstance(o, MediaEntity)]
+        yield from self.__entities
 
     @property
     def pads(self):
-        yield from [o for o in self.objects if isinstance(o, MediaPad)]
+        yield from self.__pads
 
     @property
     def links(self):
-        yield from [o for o in self.objects if isinstance(o, MediaLink)]
+        yield from self.__links
 
     @property
     def interfaces(self):
-        yield from [o for o in self.objects if isinstance(o, MediaInterface)]
+        yield from self.__interfaces
 
     def find_id(self, id) -> MediaObject | None:
-        return next((o for o in self.objects if o.id == id), None)
+        return self.__objects_by_id.get(id)
+
+    def find_links(self, id) -> list[MediaLink]:
+        """Returns the links connected to the object with the given id"""
+        return list(self.__links_by_id.get(id, []))
+
+    def find_pads(self, entity_id) -> list[MediaPad]:
+        """Returns the pads of the entity with the given id"""
+        return list(self.__pads_by_entity_id.get(entity_id, []))
 
     def find_entity(self, name):
+        # Plain names can be looked up directly, only patterns need a scan
+        if not any(c in name for c in '*?['):
+            return self.__entities_by_name.get(name)
+
         for e in self.entities:
             if fnmatch.fnmatch(e.name, name):
                 return e
@@ -195,6 +195,12 @@ class CaptureStreamer(ABC):
         self.buf_type = buf_type
         self.vbuffers: list[VideoBuffer] = []
 
+        # DQBUF only reads type, memory and the planes array from the
+        # struct, so one struct can be reused for every dequeue
+        self._dqbuf = v4l2.uapi.v4l2_buffer()
+        self._dqbuf.type = buf_type.value
+        self._dqbuf.memory = mem_type.value
+
     def set_queue_size(self, queue_size):
         v4lreqbuf = v4l2.uapi.v4l2_requestbuffers()
         v4lreqbuf.type = self.buf_type.value
@@ -333,8 +339,8 @@ class SPlaneCaptureStreamer(VideoCaptureStreamer):
         assert pix.bytesperline == self.strides[0], f'{pix.bytesperline} != {self.strides[0]}'
 
     def queue(self, vbuf: VideoBuffer):
-        assert(vbuf in self.vbuffers)
         assert(vbuf.index != -1)
+        assert(self.vbuffers[vbuf.index] is vbuf)
 
         v4l2buf = v4l2.uapi.v4l2_buffer()
         v4l2buf.type = self.buf_type.value
@@ -346,9 +352,7 @@ class SPlaneCaptureStreamer(VideoCaptureStreamer):
         fcntl.ioctl(self.fd, v4l2.uapi.VIDIOC_QBUF, v4l2buf, True)
 
     def dequeue(self) -> VideoBuffer:
-        v4l2buf = v4l2.uapi.v4l2_buffer()
-        v4l2buf.type = self.buf_type.value
-        v4l2buf.memory = self.mem_type.value
+        v4l2buf = self._dqbuf
 
         fcntl.ioctl(self.fd, v4l2.uapi.VIDIOC_DQBUF, v4l2buf, True)
 
@@ -372,6 +376,12 @@ class MPlaneCaptureStreamer(VideoCaptureStreamer):
                  width: int, height: int, format: v4l2.PixelFormat) -> None:
         super().__init__(vdev, mem_type, buf_type, width, height, format)
 
+        self.num_planes = len(format.planes)
+
+        self._dqbuf_planes = (v4l2.uapi.v4l2_plane * self.num_planes)()
+        self._dqbuf.m.planes = self._dqbuf_planes
+        self._dqbuf.length = self.num_planes
+
         self.set_format()
 
     def set_format(self):
@@ -380,7 +390,7 @@ class MPlaneCaptureStreamer(VideoCaptureStreamer):
         v4lfmt.type = self.buf_type.value
         fcntl.ioctl(self.fd, v4l2.uapi.VIDIOC_G_FMT, v4lfmt, True)
 
-        num_planes = len(self.format.planes)
+        num_planes = self.num_planes
 
         mp = v4lfmt.fmt.pix_mp
 
@@ -410,15 +420,15 @@ class MPlaneCaptureStreamer(VideoCaptureStreamer):
             assert p.sizeimage == self.buffersizes[i]
 
     def queue(self, vbuf: VideoBuffer):
-        assert(vbuf in self.vbuffers)
         assert(vbuf.index != -1)
+        assert(self.vbuffers[vbuf.index] is vbuf)
 
         v4l2buf = v4l2.uapi.v4l2_buffer()
         v4l2buf.type = self.buf_type.value
         v4l2buf.memory = vbuf.mem_type.value
         v4l2buf.index = vbuf.index
 
-        num_planes = len(self.format.planes)
+        num_planes = self.num_planes
 
         planes = (v4l2.uapi.v4l2_plane * num_planes)()
         v4l2buf.m.planes = planes
@@ -436,15 +446,7 @@ class MPlaneCaptureStreamer(VideoCaptureStreamer):
         fcntl.ioctl(self.fd, v4l2.uapi.VIDIOC_QBUF, v4l2buf, True)
 
     def dequeue(self) -> VideoBuffer:
-        v4l2buf = v4l2.uapi.v4l2_buffer()
-        v4l2buf.type = self.buf_type.value
-        v4l2buf.memory = self.mem_type.value
-
-        num_planes = len(self.format.planes)
-
-        planes = (v4l2.uapi.v4l2_plane * num_planes)()
-        v4l2buf.m.planes = planes
-        v4l2buf.length = num_planes
+        v4l2buf = self._dqbuf
 
         fcntl.ioctl(self.fd, v4l2.uapi.VIDIOC_DQBUF, v4l2buf, True)
 
@@ -534,8 +536,8 @@ class MetaCaptureStreamer(CaptureStreamer):
             self.vbuffers.append(vbuf)
 
     def queue(self, vbuf: VideoBuffer):
-        assert(vbuf in self.vbuffers)
         assert(vbuf.index != -1)
+        assert(self.vbuffers[vbuf.index] is vbuf)
 
         v4l2buf = v4l2.uapi.v4l2_buffer()
         v4l2buf.type = self.buf_type.value
@@ -547,9 +549,7 @@ class MetaCaptureStreamer(CaptureStreamer):
         fcntl.ioctl(self.fd, v4l2.uapi.VIDIOC_QBUF, v4l2buf, True)
 
     def dequeue(self) -> VideoBuffer:
-        v4l2buf = v4l2.uapi.v4l2_buffer()
-        v4l2buf.type = self.buf_type.value
-        v4l2buf.memory = self.mem_type.value
+        v4l2buf = self._dqbuf
 
         fcntl.ioctl(self.fd, v4l2.uapi.VIDIOC_DQBUF, v4l2buf, True)
 
@@ -637,8 +637,8 @@ class MetaOutputStreamer(CaptureStreamer):
             self.vbuffers.append(vbuf)
 
     def queue(self, vbuf: VideoBuffer):
-        assert(vbuf in self.vbuffers)
         assert(vbuf.index != -1)
+        assert(self.vbuffers[vbuf.index] is vbuf)
 
         v4l2buf = v4l2.uapi.v4l2_buffer()
         v4l2buf.type = self.buf_type.value
@@ -651,9 +651,7 @@ class MetaOutputStreamer(CaptureStreamer):
         fcntl.ioctl(self.fd, v4l2.uapi.VIDIOC_QBUF, v4l2buf, True)
 
     def dequeue(self) -> VideoBuffer:
-        v4l2buf = v4l2.uapi.v4l2_buffer()
-        v4l2buf.type = self.buf_type.value
-        v4l2buf.memory = self.mem_type.value
+        v4l2buf = self._dqbuf
 
         fcntl.ioctl(self.fd, v4l2.uapi.VIDIOC_DQBUF, v4l2buf, True)
 